@@ -1,24 +1,176 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import pandas as pd
 import time
 import re
 import io
+import orjson
+import xlsxwriter
 
 st.set_page_config(page_title="LinkedIn Posts Fetcher", layout="wide")
 
+_IN_RE = re.compile(r'/in/([^/]+)')
+_COMPANY_RE = re.compile(r'/company/([^/]+)')
+# API messages (lowercased) after which further pages for the same URL are pointless
+_STOP_MESSAGE_RE = re.compile(r'profile not found|profile is private|could not find linkedin profile|company not found')
+
+# Rate limits reported in the JSON message of an otherwise successful response
+_RATE_LIMIT_RE = re.compile(r'rate limit', re.IGNORECASE)
+_MAX_RATE_LIMIT_RETRIES = 5
+
+# Shared fallback for missing nested objects in API responses; never mutated
+_EMPTY = {}
+
+# Post fields copied as-is into the Excel sheet, keyed by their flattened (json_normalize) path
+_DIRECT_COLUMNS = {
+    "text": "Content Text (Original or Shared)",
+    "resharer_comment": "Resharer Comment (by Queried Profile)",
+    "time": "Time Ago",
+    "num_likes": "Engagement Likes (on this item)",
+    "num_comments": "Engagement Comments (on this item)",
+    "num_reactions": "Engagement Reactions (on this item)",
+    "num_reposts": "Engagement Reposts (of this item)",
+    "num_appreciations": "Engagement Appreciations",
+    "num_empathy": "Engagement Empathy",
+    "num_entertainments": "Engagement Entertainments",
+    "num_interests": "Engagement Interests",
+    "num_praises": "Engagement Praises",
+    "video.stream_url": "Video URL",
+    "video.duration": "Video Duration (ms)",
+    "document.title": "Document Title",
+    "document.url": "Document URL",
+    "document.page_count": "Document Page Count",
+    "article_title": "Article Title",
+    "article_subtitle": "Article Subtitle",
+    "article_target_url": "Article Target URL",
+    "article_description": "Article Description",
+    "repost_stats.num_likes": "Original Post Likes (if Reshared)",
+    "repost_stats.num_comments": "Original Post Comments (if Reshared)",
+    "repost_stats.num_reactions": "Original Post Reactions (if Reshared)",
+    "repost_stats.num_reposts": "Original Post Reposts (if Reshared)",
+    "repost_stats.num_appreciations": "Original Post Appreciations (if Reshared)",
+    "repost_stats.num_interests": "Original Post Interests (if Reshared)",
+    "repost_stats.num_praises": "Original Post Praises (if Reshared)",
+}
+_SOURCE_FIELDS = list(_DIRECT_COLUMNS) + ["reshared", "poster.first", "poster.last", "poster.headline", "poster_linkedin_url", "images"]
+
+# Columns only meaningful for reshared posts; blanked out for original posts
+_RESHARE_ONLY_COLUMNS = [
+    "Resharer Comment (by Queried Profile)",
+    "Original Post Likes (if Reshared)",
+    "Original Post Comments (if Reshared)",
+    "Original Post Reactions (if Reshared)",
+    "Original Post Reposts (if Reshared)",
+    "Original Post Appreciations (if Reshared)",
+    "Original Post Interests (if Reshared)",
+    "Original Post Praises (if Reshared)",
+]
+
+_EXCEL_COLUMNS = (
+    "Post Type",
+    "Content Author Name",
+    "Content Author Headline",
+    "Content Text (Original or Shared)",
+    "Resharer Comment (by Queried Profile)",
+    "Time Ago",
+    "Engagement Likes (on this item)",
+    "Engagement Comments (on this item)",
+    "Engagement Reactions (on this item)",
+    "Engagement Reposts (of this item)",
+    "Engagement Appreciations",
+    "Engagement Empathy",
+    "Engagement Entertainments",
+    "Engagement Interests",
+    "Engagement Praises",
+    "Image URLs",
+    "Video URL",
+    "Video Duration (ms)",
+    "Document Title",
+    "Document URL",
+    "Document Page Count",
+    "Article Title",
+    "Article Subtitle",
+    "Article Target URL",
+    "Article Description",
+    "Original Post Likes (if Reshared)",
+    "Original Post Comments (if Reshared)",
+    "Original Post Reactions (if Reshared)",
+    "Original Post Reposts (if Reshared)",
+    "Original Post Appreciations (if Reshared)",
+    "Original Post Interests (if Reshared)",
+    "Original Post Praises (if Reshared)",
+)
+
+# Shared session so consecutive page requests reuse the same TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=2,
+        backoff_max=60,
+        status_forcelist=[500, 502, 503, 504],
+        # Retry-After sleeps ignore backoff_max, so server-requested waits are handled in fetch_all_posts
+        respect_retry_after_header=False,
+    ),
+))
+
 def get_profile_name_from_url(linkedin_url):
     """Helper to extract a profile name/id from URL for display and filename."""
     if not linkedin_url:
         return "UnknownProfile"
-    match_in = re.search(r'/in/([^/]+)', linkedin_url)
+    match_in = _IN_RE.search(linkedin_url)
     if match_in:
         return match_in.group(1)
-    match_company = re.search(r'/company/([^/]+)', linkedin_url)
+    match_company = _COMPANY_RE.search(linkedin_url)
     if match_company:
         return match_company.group(1)
     return "UnknownProfile"
 
+class FetchPostsError(Exception):
+    """
+    Raised when fetching posts fails, so a partial result never ends up in the cache.
+    The posts fetched before the failure are kept on `partial`.
+    """
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial or []
+
+def _get_posts_page(api_url, headers, querystring):
+    """
+    Requests a single page of posts, waiting out rate limits (at most 60s per wait) on the same page.
+    """
+    backoff_delay = 2
+    for attempt in range(_MAX_RATE_LIMIT_RETRIES + 1):
+        try:
+            # Timeouts and 5xx responses are retried with backoff by the session's adapter
+            response = _SESSION.get(api_url, headers=headers, params=querystring, timeout=30)
+            if response.status_code == 429:
+                retry_after = response.headers.get("Retry-After", "")
+                delay = min(int(retry_after), 60) if retry_after.isdigit() else backoff_delay
+            else:
+                response.raise_for_status()
+                json_response = orjson.loads(response.content)
+                api_message = json_response.get('message') or ''
+                if not _RATE_LIMIT_RE.search(api_message):
+                    return json_response
+                st.warning(f"API Alert: {api_message}")
+                delay = backoff_delay
+        except requests.exceptions.RequestException as e:
+            raise FetchPostsError(f"Error during API request: {e}") from e
+        except ValueError as e:
+            raise FetchPostsError(f"Error decoding JSON response: {e}") from e
+
+        if attempt == _MAX_RATE_LIMIT_RETRIES:
+            break
+        st.warning(f"Rate limit exceeded. Waiting for {delay} seconds before retrying...")
+        time.sleep(delay)
+        backoff_delay = min(backoff_delay * 2, 60)
+    raise FetchPostsError(f"Rate limit still exceeded after {_MAX_RATE_LIMIT_RETRIES} retries.")
+
 def fetch_all_posts(profile_url, api_key, max_pages, post_type):
     """
     Fetches all posts for a given LinkedIn profile or company URL, handling pagination up to max_pages.
@@ -39,163 +191,146 @@ def fetch_all_posts(profile_url, api_key, max_pages, post_type):
     }
 
     progress_bar = st.progress(0)
-    status_text = st.empty()
+    last_step = -1
+    page_summaries = []
+    # End-of-fetch messages, drawn after the per-page summary to keep the page-by-page order
+    closing_messages = []
 
-    while page_count < max_pages:
-        page_count += 1
-        status_text.text(f"Fetching page {page_count} of {max_pages} for {profile_url}...")
-        progress_bar.progress(min(page_count / max_pages, 1.0))
+    try:
+        while page_count < max_pages:
+            page_count += 1
+            # Every widget update is a round-trip to the browser, so only redraw in 5% steps
+            progress = min(page_count / max_pages, 1.0)
+            step = page_count * 20 // max_pages
+            if step != last_step or page_count == max_pages:
+                progress_bar.progress(progress, text=f"Fetching page {page_count} of {max_pages} for {profile_url}...")
+                last_step = step
 
-        querystring = {
-            "linkedin_url": profile_url,
-            "type": "posts"
-        }
-        if current_pagination_token:
-            querystring["pagination_token"] = current_pagination_token
+            querystring = {
+                "linkedin_url": profile_url,
+                "type": "posts"
+            }
+            if current_pagination_token:
+                querystring["pagination_token"] = current_pagination_token
 
-        try:
-            response = requests.get(API_URL, headers=_headers, params=querystring, timeout=30)
-            response.raise_for_status()
-            json_response = response.json()
-        except requests.exceptions.Timeout:
-            st.warning("Request timed out. Retrying after a short delay...")
-            time.sleep(10)
-            continue
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error during API request: {e}")
-            break
-        except ValueError as e:
-            st.error(f"Error decoding JSON response: {e}")
-            break
+            json_response = _get_posts_page(API_URL, _headers, querystring)
 
-        api_message = json_response.get('message', 'Unknown error from API')
-        if api_message.lower() != "ok":
-            st.warning(f"API Alert: {api_message}")
-            if "rate limit" in api_message.lower():
-                st.warning("Rate limit likely exceeded. Waiting for 60 seconds before retrying...")
-                time.sleep(60)
-                continue
-
-            stop_messages = ["profile not found", "profile is private", "could not find linkedin profile", "company not found"]
-            if any(stop_msg in api_message.lower() for stop_msg in stop_messages):
-                st.error(f"Stopping pagination for {profile_url} due to: {api_message}")
-                break
+            api_message = json_response.get('message', 'Unknown error from API')
+            api_message_lc = api_message.lower()
+            if api_message_lc != "ok":
+                closing_messages.append((st.warning, f"API Alert: {api_message}"))
+                if _STOP_MESSAGE_RE.search(api_message_lc):
+                    raise FetchPostsError(f"Stopping pagination for {profile_url} due to: {api_message}")
 
-            if page_count > 1 and not json_response.get("data"):
-                st.warning("API error on subsequent page with no data, assuming end of valid pages.")
-                break
-            break
+                if page_count > 1 and not json_response.get("data"):
+                    closing_messages.append((st.warning, "API error on subsequent page with no data, assuming end of valid pages."))
+                    break
+                raise FetchPostsError(f"API request for {profile_url} failed: {api_message}")
 
-        posts_on_page = json_response.get("data", [])
+            posts_on_page = json_response.get("data")
         
-        if not posts_on_page:
-            if page_count > 1 or all_posts_data:
-                st.info("No more posts found on this page (or empty data array).")
-            else:
-                st.warning(f"No posts found on the first page for {profile_url}. Profile or company might be empty or there's an issue.")
-            break 
+            if not posts_on_page:
+                if page_count > 1 or all_posts_data:
+                    closing_messages.append((st.info, "No more posts found on this page (or empty data array)."))
+                else:
+                    st.warning(f"No posts found on the first page for {profile_url}. Profile or company might be empty or there's an issue.")
+                break 
 
-        all_posts_data.extend(posts_on_page)
-        st.info(f"Found {len(posts_on_page)} posts on page {page_count}.")
+            all_posts_data.extend(posts_on_page)
+            page_summaries.append(f"Found {len(posts_on_page)} posts on page {page_count}.")
 
-        paging_info = json_response.get("paging", {})
-        current_pagination_token = paging_info.get("pagination_token")
+            paging_info = json_response.get("paging") or _EMPTY
+            current_pagination_token = paging_info.get("pagination_token")
 
-        if not current_pagination_token:
-            st.info("No more pagination token. Reached the end of posts.")
-            break
-        
-        time.sleep(1.5)
+            if not current_pagination_token:
+                closing_messages.append((st.info, "No more pagination token. Reached the end of posts."))
+                break
+    except FetchPostsError as e:
+        raise FetchPostsError(str(e), partial=all_posts_data) from e
+    finally:
+        progress_bar.empty()
+        if page_summaries:
+            st.info("  \n".join(page_summaries))
+        for show_message, message in closing_messages:
+            show_message(message)
 
-    progress_bar.empty()
-    status_text.empty()
     return all_posts_data
 
+@st.cache_data(ttl=1800, show_spinner=False)
+def _fetch_all_posts_cached(profile_url, _api_key, max_pages, post_type):
+    """Cached wrapper around fetch_all_posts; the API key is left out of the cache key."""
+    return fetch_all_posts(profile_url, _api_key, max_pages, post_type)
+
+def _truthy(series):
+    """Element-wise truthiness of a Series, treating missing values as False."""
+    return series.notna() & series.astype(bool)
+
+@st.cache_data(ttl=1800, show_spinner=False)
 def process_posts_for_excel(raw_posts_data, queried_profile_url):
     """
-    Processes the raw post data into a list of dictionaries suitable for an Excel sheet.
+    Processes the raw post data into a DataFrame suitable for an Excel sheet.
     """
-    processed_data = []
-    queried_profile_name = get_profile_name_from_url(queried_profile_url)
-
+    posts = []
     for post in raw_posts_data:
         if not isinstance(post, dict):
             st.warning(f"Skipping non-dictionary item in posts data: {post}")
             continue
+        posts.append(post)
+    if not posts:
+        return pd.DataFrame()
 
-        poster_info = post.get("poster", {}) or {}
-        image_urls_list = post.get("images", []) or []
-        image_urls = [img.get("url") for img in image_urls_list if isinstance(img, dict) and img.get("url")]
-        video_info = post.get("video", {}) or {}
-        document_info = post.get("document", {}) or {}
-        repost_stats_info = post.get("repost_stats", {}) or {}
-
-        post_type_display = "Original Post"
-        original_content_urn_if_reshared = None
-        if post.get("reshared"):
-            post_type_display = f"Reshare by {queried_profile_name}"
-            original_content_urn_if_reshared = post.get("urn")
-
-        author_first_name = poster_info.get("first")
-        author_last_name = poster_info.get("last")
-        author_headline = poster_info.get("headline")
-        author_public_id = poster_info.get("public_id")
-        author_linkedin_url = post.get("poster_linkedin_url")
-
-        if not (author_first_name or author_last_name) and author_linkedin_url:
-            author_display_name_from_url = get_profile_name_from_url(author_linkedin_url)
-            if author_display_name_from_url != "UnknownProfile":
-                author_first_name = author_display_name_from_url
-            if not author_headline and "company" in (author_linkedin_url or ""):
-                author_headline = "Company Page"
-
-        activity_urn_str = None
-        post_url_val = post.get("post_url")
-        if post_url_val and "urn:li:activity:" in post_url_val:
-            try:
-                activity_urn_str = post_url_val.split("urn:li:activity:")[-1].split("/")[0]
-            except IndexError:
-                pass
-        
-        if post.get("reshared") and post.get("repost_urn") and not activity_urn_str:
-            activity_urn_str = post.get("repost_urn")
-
-        record = {
-            "Post Type": post_type_display,
-            "Content Author Name": (author_first_name or '') + ' ' + (author_last_name or ''),
-            "Content Author Headline": author_headline,
-            "Content Text (Original or Shared)": post.get("text"),
-            "Resharer Comment (by Queried Profile)": post.get("resharer_comment") if post.get("reshared") else None,
-            "Time Ago": post.get("time"),
-            "Engagement Likes (on this item)": post.get("num_likes"),
-            "Engagement Comments (on this item)": post.get("num_comments"),
-            "Engagement Reactions (on this item)": post.get("num_reactions"),
-            "Engagement Reposts (of this item)": post.get("num_reposts"),
-            "Engagement Appreciations": post.get("num_appreciations"),
-            "Engagement Empathy": post.get("num_empathy"),
-            "Engagement Entertainments": post.get("num_entertainments"),
-            "Engagement Interests": post.get("num_interests"),
-            "Engagement Praises": post.get("num_praises"),
-            "Image URLs": "\n".join(image_urls) if image_urls else None,
-            "Video URL": video_info.get("stream_url"),
-            "Video Duration (ms)": video_info.get("duration"),
-            "Document Title": document_info.get("title"),
-            "Document URL": document_info.get("url"),
-            "Document Page Count": document_info.get("page_count"),
-            "Article Title": post.get("article_title"),
-            "Article Subtitle": post.get("article_subtitle"),
-            "Article Target URL": post.get("article_target_url"),
-            "Article Description": post.get("article_description"),
-            "Original Post Likes (if Reshared)": repost_stats_info.get("num_likes") if post.get("reshared") else None,
-            "Original Post Comments (if Reshared)": repost_stats_info.get("num_comments") if post.get("reshared") else None,
-            "Original Post Reactions (if Reshared)": repost_stats_info.get("num_reactions") if post.get("reshared") else None,
-            "Original Post Reposts (if Reshared)": repost_stats_info.get("num_reposts") if post.get("reshared") else None,
-            "Original Post Appreciations (if Reshared)": repost_stats_info.get("num_appreciations") if post.get("reshared") else None,
-            "Original Post Interests (if Reshared)": repost_stats_info.get("num_interests") if post.get("reshared") else None,
-            "Original Post Praises (if Reshared)": repost_stats_info.get("num_praises") if post.get("reshared") else None,
-        }
-        processed_data.append(record)
-    return processed_data
+    queried_profile_name = get_profile_name_from_url(queried_profile_url)
+    raw = pd.json_normalize(posts, max_level=1).reindex(columns=_SOURCE_FIELDS)
+
+    reshared = _truthy(raw["reshared"])
+    author_first_name = raw["poster.first"].astype(object)
+    author_last_name = raw["poster.last"].astype(object)
+    author_headline = raw["poster.headline"].astype(object)
+    author_linkedin_url = raw["poster_linkedin_url"]
+
+    # Fall back to the poster URL for authors whose name fields are empty
+    # (normally every poster has a name, so skip the URL parsing entirely in that case)
+    needs_fallback = ~(_truthy(author_first_name) | _truthy(author_last_name)) & _truthy(author_linkedin_url)
+    if needs_fallback.any():
+        fallback_urls = author_linkedin_url[needs_fallback]
+        names_from_url = fallback_urls.map(get_profile_name_from_url)
+        names_from_url = names_from_url[names_from_url != "UnknownProfile"]
+        author_first_name.loc[names_from_url.index] = names_from_url
+        is_company_url = fallback_urls.map(lambda url: "company" in url).reindex(raw.index, fill_value=False).astype(bool)
+        author_headline.loc[is_company_url & ~_truthy(author_headline)] = "Company Page"
+
+    columns = {excel_col: raw[field] for field, excel_col in _DIRECT_COLUMNS.items()}
+    for col in _RESHARE_ONLY_COLUMNS:
+        columns[col] = columns[col].where(reshared)
+    columns["Post Type"] = reshared.map({True: f"Reshare by {queried_profile_name}", False: "Original Post"})
+    columns["Content Author Name"] = author_first_name.fillna('') + ' ' + author_last_name.fillna('')
+    columns["Content Author Headline"] = author_headline
+    image_urls = raw["images"].explode().map(lambda img: img.get("url") if isinstance(img, dict) else None)
+    image_urls = image_urls[_truthy(image_urls)]
+    columns["Image URLs"] = image_urls.groupby(level=0).agg("\n".join).reindex(raw.index)
+    return pd.DataFrame({col: columns[col] for col in _EXCEL_COLUMNS})
+
+@st.cache_data(ttl=1800, show_spinner=False)
+def build_excel_file(df):
+    """
+    Serializes the DataFrame to .xlsx bytes, streaming one row at a time so memory stays flat.
+    """
+    output = io.BytesIO()
+    # pandas' to_excel writes column by column, which constant_memory mode cannot handle,
+    # so rows are written directly through xlsxwriter instead.
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "strings_to_urls": False,
+        "strings_to_formulas": False,
+    })
+    worksheet = workbook.add_worksheet()
+    # Same header style pandas' to_excel applies
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    worksheet.write_row(0, 0, df.columns, header_format)
+    for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, [None if pd.isna(value) else value for value in row])
+    workbook.close()
+    return output.getvalue()
 
 # Sidebar inputs
 st.sidebar.header("LinkedIn Posts Fetcher")
@@ -214,21 +349,22 @@ if st.button("Fetch Posts"):
     elif not linkedin_url or not linkedin_url.startswith("https://www.linkedin.com/"):
         st.error("Please enter a valid LinkedIn profile or company URL.")
     else:
-        with st.spinner(f"Fetching {post_type.lower()}..."):
-            all_raw_posts = fetch_all_posts(linkedin_url, api_key, max_pages, post_type)
+        try:
+            with st.spinner(f"Fetching {post_type.lower()}..."):
+                all_raw_posts = _fetch_all_posts_cached(linkedin_url, api_key, max_pages, post_type)
+        except FetchPostsError as e:
+            # Still show whatever was fetched before the failure; it just isn't cached
+            st.error(str(e))
+            all_raw_posts = e.partial
 
         if all_raw_posts:
             st.success(f"Fetched a total of {len(all_raw_posts)} post items.")
-            excel_data = process_posts_for_excel(all_raw_posts, linkedin_url)
+            df = process_posts_for_excel(all_raw_posts, linkedin_url)
 
-            if excel_data:
-                df = pd.DataFrame(excel_data)
+            if not df.empty:
                 st.dataframe(df, use_container_width=True)
 
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False)
-                excel_data = output.getvalue()
+                excel_data = build_excel_file(df)
                 
                 profile_name = get_profile_name_from_url(linkedin_url)
                 st.download_button(